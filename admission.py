@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from io import BytesIO
+
+import pillow_heif
+import requests
+from PIL import Image, UnidentifiedImageError
+
+from image_utils import resized_size
+
+# ─────────────────────────────────────────────────────────────
+# Memory-aware admission control for /evaluate
+# ─────────────────────────────────────────────────────────────
+MB = 1024 * 1024
+
+# Global in-flight memory budget shared by all /evaluate requests
+MEMORY_BUDGET_BYTES  = int(os.getenv("ADMISSION_MEMORY_BUDGET_MB", "3072")) * MB
+# Fixed cost per request: interpreter, torch and the SegFormer weights
+BASE_REQUEST_BYTES   = int(os.getenv("ADMISSION_BASE_MB", "768")) * MB
+# How long a request may queue for budget before it is rejected with 503
+QUEUE_TIMEOUT_S      = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# Assumed size when the header cannot be read (typical phone photo)
+FALLBACK_SIZE        = (4032, 3024)
+
+NUM_CLASSES   = 47        # sayeed99/segformer-b3-fashion output channels
+PROBE_CHUNK   = 64 * 1024
+PROBE_LIMIT   = 1024 * 1024
+
+
+def _size_from_bytes(data: bytes):
+    """Read (width, height) from image header bytes, or None if incomplete."""
+    try:
+        return Image.open(BytesIO(data)).size
+    except (UnidentifiedImageError, OSError):
+        pass
+    try:
+        return pillow_heif.open_heif(BytesIO(data)).size
+    except (ValueError, RuntimeError, OSError):
+        return None
+
+
+def probe_image_size(input_path: str):
+    """Return (width, height, is_heif) without decoding pixel data.
+
+    URLs are streamed until the header parses (at most PROBE_LIMIT bytes).
+    Falls back to FALLBACK_SIZE when the header cannot be read.
+    """
+    size = None
+    if input_path.startswith(("http://", "https://")):
+        data = b""
+        with requests.get(input_path, stream=True, timeout=10) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(PROBE_CHUNK):
+                data += chunk
+                size = _size_from_bytes(data)
+                if size or len(data) >= PROBE_LIMIT:
+                    break
+    else:
+        with open(input_path, "rb") as f:
+            data = f.read(PROBE_LIMIT)
+        size = _size_from_bytes(data)
+
+    # The ftyp box is at the start, so HEIF is detectable even if the size isn't
+    is_heif = bool(data) and pillow_heif.is_supported(data)
+    if size is None:
+        return FALLBACK_SIZE[0], FALLBACK_SIZE[1], is_heif
+    return size[0], size[1], is_heif
+
+
+def estimate_peak_bytes(width: int, height: int, is_heif: bool = False, max_size: int = 1024) -> int:
+    """Estimate peak memory of one pipeline run for an image of this size.
+
+    Segmentation holds the original decode (twice for HEIF), the resized copy,
+    the float32 upsampled logits and the argmax mask; the Gemini step holds the
+    full-size image plus crops. The two steps run one after the other.
+    """
+    w, h = resized_size((width, height), max_size)
+    original = width * height * 3
+    resized = w * h * 3
+
+    segmentation = (original * (2 if is_heif else 1)
+                    + resized
+                    + NUM_CLASSES * w * h * 4  # upsampled logits (C, H, W) float32
+                    + w * h * 8                # argmax mask (int64)
+                    + w * h)                   # per-class boolean mask
+    gemini = original * 2  # full image + crops (bounded by the image itself)
+    return BASE_REQUEST_BYTES + max(segmentation, gemini)
+
+
+def estimate_request_bytes(input_path: str) -> int:
+    """Peak memory estimate for input_path; probe failures use FALLBACK_SIZE.
+
+    Download/open errors are left for the pipeline itself to report.
+    """
+    try:
+        width, height, is_heif = probe_image_size(input_path)
+    except (requests.RequestException, OSError):
+        width, height, is_heif = FALLBACK_SIZE[0], FALLBACK_SIZE[1], False
+    return estimate_peak_bytes(width, height, is_heif)
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes: callers are admitted in FIFO order."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: float) -> int | None:
+        """Reserve nbytes, waiting up to timeout seconds.
+
+        Only the head of the queue is admitted, so later small requests
+        cannot starve an earlier large one. Requests larger than the whole
+        budget are clamped so they run alone.
+        Returns the reserved amount, or None if the budget never freed up.
+        """
+        nbytes = min(nbytes, self.capacity)
+        deadline = time.monotonic() + timeout
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self.in_use + nbytes > self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return None
+                    self._cond.wait(remaining)
+                self.in_use += nbytes
+                self.in_flight += 1
+                return nbytes
+            finally:
+                # Either way the next ticket may now be at the head
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.in_use -= nbytes
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def usage(self) -> dict:
+        with self._cond:
+            return {
+                "capacity_mb": round(self.capacity / MB, 1),
+                "in_use_mb": round(self.in_use / MB, 1),
+                "utilization": round(self.in_use / self.capacity, 3) if self.capacity else 0.0,
+                "in_flight": self.in_flight,
+                "waiting": len(self._queue),
+                "rejected": self.rejected,
+            }
+
+
+memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES)
@@ -0,0 +1,98 @@
+import os
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+# ─────────────────────────────────────────────────────────────
+# Single-flight coalescing of identical /evaluate requests
+# ─────────────────────────────────────────────────────────────
+# How long a coalesced request waits for the in-flight one before giving up
+COALESCE_TIMEOUT_S = float(os.getenv("COALESCE_TIMEOUT", "120"))
+
+
+class CoalesceTimeout(Exception):
+    """Raised to a waiter whose in-flight leader did not finish in time."""
+
+
+def normalize_input_path(input_path: str) -> str:
+    """Normalize input_path so trivially different spellings share a key.
+
+    URL detection matches load_image (lowercase scheme only), so paths the
+    pipeline would open differently never share a key.
+    """
+    if input_path.startswith(("http://", "https://")):
+        parts = urlsplit(input_path)
+        # Only the host is case-insensitive; credentials must stay distinct
+        userinfo, at, hostport = parts.netloc.rpartition("@")
+        return urlunsplit((parts.scheme, userinfo + at + hostport.lower(),
+                           parts.path or "/", parts.query, ""))
+    return os.path.abspath(input_path)
+
+
+def request_key(input_path: str, **params) -> tuple:
+    """Coalescing key: normalized input_path plus the pipeline parameters."""
+    return (normalize_input_path(input_path),) + tuple(sorted(params.items()))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key; concurrent callers share its outcome.
+
+    Results and exceptions are handed to the waiters of that call only and
+    are never cached: the key is released as soon as the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout: float):
+        """Return (result, shared); shared is True for coalesced callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise CoalesceTimeout(f"Identical request still running after {timeout:g}s")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "waiter_timeouts": self.timeouts,
+            }
+
+
+single_flight = SingleFlight()
@@ -6,6 +6,10 @@ import os
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 
+from admission import QUEUE_TIMEOUT_S, estimate_request_bytes, memory_budget
+from coalescing import COALESCE_TIMEOUT_S, CoalesceTimeout, request_key, single_flight
+from profiling import new_profile_dir, profile_block, profiled_command, should_profile
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -17,34 +21,48 @@ SEGMENTS_JSON          = "segments.json"
 GEMINI_RECOMMENDATIONS_JSON = "gemini_recommendations.json"
 ANNOTATED_IMAGE_OUTPUT = "annotated.png"  # only this is hard-coded
 
-def run_segmentation(input_path: str):
-    subprocess.run([
+# Class policy JSON for segmentation (empty -> built-in default policy)
+CLASS_POLICY_JSON      = os.getenv("CLASS_POLICY_JSON", "")
+# Cap on Gemini calls per image, including the overall outfit call
+MAX_GEMINI_CALLS       = int(os.getenv("MAX_GEMINI_CALLS", "8"))
+if MAX_GEMINI_CALLS < 1:
+    raise RuntimeError("MAX_GEMINI_CALLS must be at least 1 (the overall outfit call)")
+
+def run_segmentation(input_path: str, profile_dir: str | None = None):
+    cmd = [
         sys.executable, "segmentation.py",
         input_path,
         "--segments-json", SEGMENTS_JSON,
         "--annotated-output", ANNOTATED_IMAGE_OUTPUT
-    ], check=True)
+    ]
+    if CLASS_POLICY_JSON:
+        cmd += ["--class-policy", CLASS_POLICY_JSON]
+    if profile_dir:
+        cmd += ["--torch-profile", os.path.join(profile_dir, "torch_ops.txt")]
+    subprocess.run(profiled_command(cmd, profile_dir, "segmentation"), check=True)
     print(f"✅ Segments written to {SEGMENTS_JSON}")
     print(f"✅ Annotated image saved to {ANNOTATED_IMAGE_OUTPUT}")
 
-def run_gemini_recommendations(input_path: str):
-    subprocess.run([
+def run_gemini_recommendations(input_path: str, profile_dir: str | None = None):
+    cmd = [
         sys.executable, "gemini_recommendations.py",
         "--input", input_path,
         "--segments-json", SEGMENTS_JSON,
-        "--output", GEMINI_RECOMMENDATIONS_JSON
-    ], check=True)
+        "--output", GEMINI_RECOMMENDATIONS_JSON,
+        "--max-calls", str(MAX_GEMINI_CALLS)
+    ]
+    subprocess.run(profiled_command(cmd, profile_dir, "gemini"), check=True)
     print(f"✅ Gemini recommendations written to {GEMINI_RECOMMENDATIONS_JSON}")
 
-def run_pipeline(input_path: str):
+def run_pipeline(input_path: str, profile_dir: str | None = None):
     """Run the complete pipeline and return results"""
     try:
         print("🎯 Starting Gemini pipeline...")
         print("Step 1: Running segmentation...")
-        run_segmentation(input_path)
+        run_segmentation(input_path, profile_dir)
         
         print("Step 2: Getting Gemini recommendations...")
-        run_gemini_recommendations(input_path)
+        run_gemini_recommendations(input_path, profile_dir)
 
         print("🚀 Gemini pipeline complete!")
         
@@ -95,6 +113,10 @@ def run_pipeline(input_path: str):
                 'recommendations': overall_data.get('recommendations', [])
             }
         
+        # Report how many Gemini calls the class policy and call cap saved
+        if 'gemini_calls' in recommendations_data:
+            results['gemini_calls'] = recommendations_data['gemini_calls']
+        
         # Add annotated image path if it exists
         if os.path.exists(ANNOTATED_IMAGE_OUTPUT):
             results['annotated_image'] = ANNOTATED_IMAGE_OUTPUT
@@ -106,6 +128,33 @@ def run_pipeline(input_path: str):
         return {"error": str(e)}
 
 
+def evaluate_once(input_path: str, profile: bool = False):
+    """Admit and run one pipeline; returns (body, status, headers)"""
+    # Reserve memory for this request before decoding anything
+    reserved = memory_budget.acquire(estimate_request_bytes(input_path), QUEUE_TIMEOUT_S)
+    if reserved is None:
+        return {
+            "error": "Server is at its memory budget, retry later",
+            "memory_budget": memory_budget.usage()
+        }, 503, {"Retry-After": str(max(int(QUEUE_TIMEOUT_S), 1))}
+    
+    # Run the pipeline (profiled on request or by sampling)
+    profile_dir = new_profile_dir() if profile else None
+    try:
+        with profile_block(profile_dir, "pipeline"):
+            results = run_pipeline(input_path, profile_dir)
+    finally:
+        memory_budget.release(reserved)
+    
+    if profile_dir:
+        results['profile'] = profile_dir
+    
+    if "error" in results:
+        return results, 500, {}
+    
+    return results, 200, {}
+
+
 @app.route('/evaluate', methods=['POST'])
 def evaluate():
     """Evaluate endpoint for fashion analysis"""
@@ -126,13 +175,24 @@ def evaluate():
                 "error": "Input path cannot be empty"
             }), 400
         
-        # Run the pipeline
-        results = run_pipeline(input_path)
-        
-        if "error" in results:
-            return jsonify(results), 500
+        # Identical in-flight requests share one pipeline run; profiled
+        # requests always run on their own so they get their own profile
+        if should_profile(request.headers):
+            (body, status, headers), shared = evaluate_once(input_path, profile=True), False
+        else:
+            key = request_key(input_path, class_policy=CLASS_POLICY_JSON, max_gemini_calls=MAX_GEMINI_CALLS)
+            try:
+                (body, status, headers), shared = single_flight.do(
+                    key, lambda: evaluate_once(input_path), COALESCE_TIMEOUT_S
+                )
+            except CoalesceTimeout as e:
+                return jsonify({"error": str(e)}), 504
         
-        return jsonify(results)
+        response = jsonify(body)
+        response.headers.update(headers)
+        if shared:
+            response.headers["X-Coalesced"] = "true"
+        return response, status
         
     except Exception as e:
         return jsonify({
@@ -145,7 +205,9 @@ def health():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
-        "service": "fashion-recommendation-pipeline"
+        "service": "fashion-recommendation-pipeline",
+        "memory_budget": memory_budget.usage(),
+        "coalescing": single_flight.stats()
     })
 
 
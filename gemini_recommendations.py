@@ -252,9 +252,40 @@ def get_overall_outfit_recommendations(image: Image.Image, segments: list) -> li
         ]
 
 
-def analyze_segments_with_gemini(image_url: str, segments: list, output_path: str):
+def select_segments_for_gemini(segments: list, max_calls: int | None) -> tuple[list, int]:
+    """Pick the segments that get a per-item Gemini call.
+
+    Overall-only segments never get one. If max_calls is set, one call is
+    reserved for the overall outfit and the largest segments fill the rest.
+    Returns (selected segments in original order, number of capped segments).
+    """
+    candidates = [seg for seg in segments if not seg.get("overall_only")]
+    if max_calls is None:
+        return candidates, 0
+
+    budget = max(max_calls - 1, 0)
+    if len(candidates) <= budget:
+        return candidates, 0
+
+    def area(seg):
+        x1, y1, x2, y2 = seg["bbox"]
+        return (x2 - x1) * (y2 - y1)
+
+    keep = sorted(range(len(candidates)), key=lambda i: area(candidates[i]), reverse=True)[:budget]
+    selected = [candidates[i] for i in sorted(keep)]
+    return selected, len(candidates) - len(selected)
+
+
+def analyze_segments_with_gemini(image_url: str, segments: list, output_path: str,
+                                 max_calls: int | None = None, class_policy: dict | None = None):
     """Analyze segments and get recommendations directly from Gemini"""
     
+    selected, capped = select_segments_for_gemini(segments, max_calls)
+    # Policed classes large enough to have survived filtering (see segment_image)
+    calls_saved = capped + (class_policy or {}).get("calls_saved", 0)
+    if capped:
+        print(f"✂️  Gemini call cap ({max_calls}/image) skipped {capped} segments")
+    
     # Download the full image
     print(f"📥 Downloading image from {image_url}...")
     resp = requests.get(image_url)
@@ -263,12 +294,12 @@ def analyze_segments_with_gemini(image_url: str, segments: list, output_path: st
     
     result = {}
     
-    for i, seg in enumerate(segments):
+    for i, seg in enumerate(selected):
         label = str(seg["label"])
         item_type = segmentation_labels.get(label, "Unknown item")
         x1, y1, x2, y2 = seg["bbox"]
         
-        print(f"🔍 Analyzing segment {i+1}/{len(segments)}: {item_type} (label {label})...")
+        print(f"🔍 Analyzing segment {i+1}/{len(selected)}: {item_type} (label {label})...")
         
         # Crop the segment
         crop = full_img.crop((x1, y1, x2, y2))
@@ -300,6 +331,14 @@ def analyze_segments_with_gemini(image_url: str, segments: list, output_path: st
         print(f"   {j}. {rec}")
     print()
     
+    result["gemini_calls"] = {
+        "made": len(selected) + 1,
+        "saved": calls_saved,
+        "capped": capped,
+        "max_per_image": max_calls
+    }
+    print(f"📉 Gemini calls: {len(selected) + 1} made, {calls_saved} saved")
+    
     # Save results
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(result, f, indent=2)
@@ -307,17 +346,28 @@ def analyze_segments_with_gemini(image_url: str, segments: list, output_path: st
     print(f"✅ Saved recommendations to {output_path}")
 
 
+def positive_int(value: str) -> int:
+    """argparse type for integers >= 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser("Get fashion recommendations from Gemini using segmentation")
     parser.add_argument("--input", required=True, help="Image URL or path")
     parser.add_argument("--segments-json", required=True, help="Path to segments JSON file")
     parser.add_argument("--output", "-o", default="gemini_recommendations.json", help="Output JSON file")
+    parser.add_argument("--max-calls", type=positive_int, default=None,
+                        help="Maximum Gemini calls per image, including the overall outfit call")
     args = parser.parse_args()
     
     # Load segments
     with open(args.segments_json, "r", encoding="utf-8") as f:
         data = json.load(f)
     segments = data.get("segments", [])
+    class_policy = data.get("class_policy", {})
     
     if not segments:
         print("❌ No segments found in the JSON file")
@@ -326,7 +376,7 @@ def main():
     print(f"🎯 Found {len(segments)} segments to analyze")
     
     # Analyze segments with Gemini
-    analyze_segments_with_gemini(args.input, segments, args.output)
+    analyze_segments_with_gemini(args.input, segments, args.output, args.max_calls, class_policy)
 
 
 if __name__ == "__main__":
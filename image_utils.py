@@ -0,0 +1,6 @@
+def resized_size(size, max_size=1024):
+    """Size an image is resized to by load_image (longest side <= max_size)."""
+    if max(size) <= max_size:
+        return tuple(size)
+    ratio = max_size / max(size)
+    return tuple(int(d * ratio) for d in size)
@@ -0,0 +1,135 @@
+import argparse
+import cProfile
+import os
+import pstats
+import random
+import shutil
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+# ─────────────────────────────────────────────────────────────
+# Opt-in per-request profiling
+# ─────────────────────────────────────────────────────────────
+PROFILE_DIR            = os.getenv("PROFILE_DIR", "profiles")
+# Number of profiled requests kept on disk; oldest are deleted first
+PROFILE_RETENTION      = int(os.getenv("PROFILE_RETENTION", "20"))
+# Fraction of /evaluate requests profiled without being asked to (0.0 - 1.0)
+PROFILE_SAMPLE_RATE    = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Whether clients may request a profile with the X-Profile header
+PROFILE_HEADER_ENABLED = os.getenv("PROFILE_HEADER_ENABLED", "false").lower() == "true"
+PROFILE_HEADER         = "X-Profile"
+
+
+def should_profile(headers) -> bool:
+    """Decide whether this request is profiled (header opt-in or sampling)."""
+    if PROFILE_HEADER_ENABLED and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def prune_profiles(root: str = PROFILE_DIR, keep: int = PROFILE_RETENTION):
+    """Delete all but the newest `keep` profile directories under root."""
+    if not os.path.isdir(root):
+        return
+    runs = sorted(
+        (entry for entry in os.scandir(root) if entry.is_dir()),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in runs[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def new_profile_dir(root: str = PROFILE_DIR) -> str:
+    """Create a directory for one profiled request, enforcing retention."""
+    path = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    prune_profiles(root, max(PROFILE_RETENTION, 1))
+    return path
+
+
+def profiled_command(cmd: list, profile_dir: str | None, name: str) -> list:
+    """Wrap a `python script.py ...` command so it runs under cProfile."""
+    if not profile_dir:
+        return cmd
+    output = os.path.join(profile_dir, f"{name}.pstats")
+    return [cmd[0], "-m", "cProfile", "-o", output] + cmd[1:]
+
+
+@contextmanager
+def profile_block(profile_dir: str | None, name: str):
+    """Profile the enclosed block with cProfile into <profile_dir>/<name>.pstats."""
+    if not profile_dir:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.pstats"))
+
+
+def summarize_pstats(path: str, limit: int, sort: str):
+    stats = pstats.Stats(path)
+    stats.sort_stats(sort).print_stats(limit)
+
+
+def summarize_stacks(path: str, limit: int):
+    """Summarize a collapsed-stack file (`frame;frame;... value` per line)."""
+    self_time = Counter()
+    total_time = Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, value = line.rstrip("\n").rpartition(" ")
+            try:
+                value = float(value)
+            except ValueError:
+                continue  # stray or partially written line
+            if not stack:
+                continue
+            frames = stack.split(";")
+            self_time[frames[-1]] += value
+            for frame in set(frames):
+                total_time[frame] += value
+
+    grand_total = sum(self_time.values()) or 1
+    print(f"{'self %':>7} {'self':>14} {'total':>14}  frame")
+    for frame, value in self_time.most_common(limit):
+        print(f"{100 * value / grand_total:6.1f}% {value:14.0f} {total_time[frame]:14.0f}  {frame}")
+
+
+def main():
+    p = argparse.ArgumentParser("Summarize the hottest frames of a profiled request")
+    p.add_argument("path", help="Profile directory, .pstats file or collapsed-stack .txt file")
+    p.add_argument("--limit", "-n", type=int, default=20, help="Number of frames to show (default: 20)")
+    p.add_argument(
+        "--sort",
+        default="tottime",
+        help="pstats sort key, e.g. tottime or cumulative (default: tottime)"
+    )
+    args = p.parse_args()
+
+    if os.path.isdir(args.path):
+        files = sorted(os.path.join(args.path, name) for name in os.listdir(args.path))
+    else:
+        files = [args.path]
+    files = [path for path in files if path.endswith((".pstats", ".txt"))]
+    if not files:
+        print(f"❌ No .pstats or .txt profile files in {args.path}")
+        sys.exit(1)
+
+    for path in files:
+        print(f"🔥 {path}")
+        if path.endswith(".pstats"):
+            summarize_pstats(path, args.limit, args.sort)
+        else:
+            summarize_stacks(path, args.limit)
+        print()
+
+if __name__ == "__main__":
+    main()
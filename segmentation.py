@@ -9,6 +9,32 @@ import torch.nn as nn
 from PIL import Image, ImageDraw, UnidentifiedImageError
 from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
 
+from image_utils import resized_size
+
+# Whole garments (shirt ... cape) that detail classes can be folded into
+GARMENT_LABELS = set(range(1, 14))
+
+# Default class policy for garment parts and trims (labels 28-46).
+#   drop         -> never emitted as a segment
+#   fold         -> bbox is merged into the overlapping parent garment
+#   overall_only -> kept for the overall outfit prompt, no per-item Gemini call
+DEFAULT_CLASS_POLICY = {
+    "drop": [38, 43, 45],  # bead, rivet, sequin
+    "fold": [28, 29, 30, 31, 32, 33, 34, 36],  # hood, collar, lapel, epaulette, sleeve, pocket, neckline, zipper
+    "overall_only": [35, 37, 39, 40, 41, 42, 44, 46],  # buckle, applique, bow, flower, fringe, ribbon, ruffle, tassel
+}
+
+def load_class_policy(path=None):
+    """Load a class policy JSON file, falling back to DEFAULT_CLASS_POLICY."""
+    if not path:
+        return DEFAULT_CLASS_POLICY
+    with open(path, "r", encoding="utf-8") as f:
+        policy = json.load(f)
+    unknown = set(policy) - set(DEFAULT_CLASS_POLICY)
+    if unknown:
+        raise ValueError(f"Unknown class policy keys: {sorted(unknown)}")
+    return {key: [int(cls) for cls in policy.get(key, [])] for key in DEFAULT_CLASS_POLICY}
+
 def load_image(input_path, max_size=1024):
     if input_path.startswith(("http://", "https://")):
         resp = requests.get(input_path)
@@ -25,8 +51,7 @@ def load_image(input_path, max_size=1024):
     else:
         img = Image.open(input_path).convert("RGB")
     if max(img.size) > max_size:
-        ratio = max_size / max(img.size)
-        img = img.resize(tuple(int(d * ratio) for d in img.size),
+        img = img.resize(resized_size(img.size, max_size),
                          Image.Resampling.LANCZOS)
     return img
 
@@ -51,6 +76,33 @@ def calculate_iou(box1, box2):
     
     return intersection / union if union > 0 else 0.0
 
+def intersection_area(box1, box2):
+    """Calculate the intersection area of two bounding boxes."""
+    w = min(box1[2], box2[2]) - max(box1[0], box2[0])
+    h = min(box1[3], box2[3]) - max(box1[1], box2[1])
+    return w * h if w > 0 and h > 0 else 0
+
+def fold_into_parents(segments, details):
+    """Fold detail segments into the garment they overlap most.
+
+    Returns the number of details folded; details without an overlapping
+    garment are discarded.
+    """
+    garments = [seg for seg in segments if seg["label"] in GARMENT_LABELS]
+    folded = 0
+    for detail in details:
+        overlaps = [(intersection_area(g["bbox"], detail["bbox"]), g) for g in garments]
+        overlaps = [(area, g) for area, g in overlaps if area > 0]
+        if not overlaps:
+            continue
+        _, parent = max(overlaps, key=lambda item: item[0])
+        box, dbox = parent["bbox"], detail["bbox"]
+        parent["bbox"] = [min(box[0], dbox[0]), min(box[1], dbox[1]),
+                          max(box[2], dbox[2]), max(box[3], dbox[3])]
+        parent.setdefault("folded_labels", []).append(detail["label"])
+        folded += 1
+    return folded
+
 def merge_overlapping_boxes(segments, iou_threshold=0.3):
     """Merge segments with overlapping bounding boxes."""
     if not segments:
@@ -66,6 +118,7 @@ def merge_overlapping_boxes(segments, iou_threshold=0.3):
         # Start with current segment
         merged_box = seg1["bbox"][:]
         merged_labels = [seg1["label"]]
+        folded_labels = list(seg1.get("folded_labels", []))
         used.add(i)
         
         # Find overlapping segments
@@ -82,22 +135,31 @@ def merge_overlapping_boxes(segments, iou_threshold=0.3):
                 y2 = max(merged_box[3], seg2["bbox"][3])
                 merged_box = [x1, y1, x2, y2]
                 merged_labels.append(seg2["label"])
+                folded_labels.extend(seg2.get("folded_labels", []))
                 used.add(j)
         
-        merged.append({
+        merged_seg = {
             "label": merged_labels[0],  # Use first label
             "merged_labels": merged_labels,  # Keep track of all merged labels
             "bbox": merged_box
-        })
+        }
+        if folded_labels:
+            merged_seg["folded_labels"] = folded_labels
+        merged.append(merged_seg)
     
     return merged
 
-def filter_small_segments(segments, min_area=1000, image_size=None):
-    """Filter out segments that are too small."""
+def effective_min_area(min_area=1000, image_size=None):
+    """Minimum segment area used by filter_small_segments."""
     if image_size:
         # Calculate minimum area as percentage of image
         img_area = image_size[0] * image_size[1]
         min_area = max(min_area, img_area * 0.01)  # At least 1% of image
+    return min_area
+
+def filter_small_segments(segments, min_area=1000, image_size=None):
+    """Filter out segments that are too small."""
+    min_area = effective_min_area(min_area, image_size)
     
     filtered = []
     for seg in segments:
@@ -108,7 +170,21 @@ def filter_small_segments(segments, min_area=1000, image_size=None):
     
     return filtered
 
-def segment_image(image, processor, model):
+def segment_image(image, processor, model, class_policy=None, min_area=0):
+    """Segment an image into per-class bounding boxes.
+
+    The class policy is applied before any bbox work: dropped classes are
+    skipped outright, fold classes are merged into their parent garment and
+    overall_only classes are flagged so they never get a per-item Gemini call.
+    Policed classes that would have passed the min_area filter are counted as
+    calls_saved (dropped classes by pixel count, a lower bound on bbox area).
+    Returns (segments, policy_report).
+    """
+    policy = class_policy or {}
+    drop = set(policy.get("drop", []))
+    fold = set(policy.get("fold", []))
+    overall_only = set(policy.get("overall_only", []))
+
     inputs = processor(images=image, return_tensors="pt")
     with torch.no_grad():
         logits = model(**inputs).logits.cpu()  # (1, C, H', W')
@@ -119,18 +195,35 @@ def segment_image(image, processor, model):
         align_corners=False,
     )[0]  # (C, H, W)
     mask = up.argmax(dim=0).numpy()  # (H, W)
+    pixel_counts = np.bincount(mask.ravel())
     
     segments = []
-    for cls in sorted(set(mask.flatten())):
+    details = []
+    report = {"dropped": 0, "folded": 0, "overall_only": 0, "calls_saved": 0}
+    for cls in np.flatnonzero(pixel_counts):
         if cls == 0:  # Skip background
             continue
-        ys, xs = np.where(mask == cls)
-        if not len(xs):
+        if cls in drop:
+            report["dropped"] += 1
+            report["calls_saved"] += int(pixel_counts[cls] >= min_area)
             continue
+        ys, xs = np.where(mask == cls)
         x1, y1, x2, y2 = int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max())
-        segments.append({"label": int(cls), "bbox": [x1, y1, x2, y2]})
+        seg = {"label": int(cls), "bbox": [x1, y1, x2, y2]}
+        if cls in fold or cls in overall_only:
+            report["calls_saved"] += int((x2 - x1) * (y2 - y1) >= min_area)
+        if cls in fold:
+            details.append(seg)
+            continue
+        if cls in overall_only:
+            seg["overall_only"] = True
+            report["overall_only"] += 1
+        segments.append(seg)
+
+    report["folded"] = fold_into_parents(segments, details)
+    report["dropped"] += len(details) - report["folded"]
     
-    return segments
+    return segments, report
 
 def draw_boxes(image: Image.Image, segments: list[dict], outline="red", width=3):
     draw = ImageDraw.Draw(image)
@@ -173,6 +266,19 @@ def main():
         action="store_true",
         help="Skip filtering small segments"
     )
+    p.add_argument(
+        "--class-policy",
+        help="JSON file with 'drop', 'fold' and 'overall_only' label lists (default: built-in policy)"
+    )
+    p.add_argument(
+        "--no-class-policy",
+        action="store_true",
+        help="Emit a segment for every detected class"
+    )
+    p.add_argument(
+        "--torch-profile",
+        help="If set, profile torch ops in the model call and write them as collapsed stacks here"
+    )
     args = p.parse_args()
 
     # 1) load & resize
@@ -186,22 +292,45 @@ def main():
     )
 
     # 3) segment
-    segs = segment_image(img, proc, mdl)
+    policy = None if args.no_class_policy else load_class_policy(args.class_policy)
+    min_area = 0 if args.no_filter else effective_min_area(args.min_area, img.size)
+    if args.torch_profile:
+        # No with_stack: torch's Python tracer would replace the cProfile hook
+        # this script may be running under and blind it for the rest of the run
+        from torch.profiler import ProfilerActivity, profile
+        with profile(activities=[ProfilerActivity.CPU]) as prof:
+            segs, policy_report = segment_image(img, proc, mdl, policy, min_area)
+        with open(args.torch_profile, "w", encoding="utf-8") as f:
+            for evt in prof.key_averages():
+                if evt.self_cpu_time_total > 0:
+                    op = evt.key.replace(";", ",")
+                    f.write(f"segment_image;{op} {int(evt.self_cpu_time_total)}\n")
+        print(f"🔥 Wrote torch op timings (collapsed stacks) to {args.torch_profile}")
+    else:
+        segs, policy_report = segment_image(img, proc, mdl, policy, min_area)
     print(f"🔍 Found {len(segs)} initial segments")
+    print(f"🏷️  Class policy: {policy_report['dropped']} dropped, "
+          f"{policy_report['folded']} folded, {policy_report['overall_only']} overall-only")
 
     # 4) Filter small segments
     if not args.no_filter:
         segs = filter_small_segments(segs, args.min_area, img.size)
         print(f"🧹 After filtering small segments: {len(segs)}")
 
+    # Overall-only details skip merging so they stay out of per-item boxes
+    overall_segs = [seg for seg in segs if seg.get("overall_only")]
+    segs = [seg for seg in segs if not seg.get("overall_only")]
+
     # 5) Merge overlapping segments
     if not args.no_merge:
         segs = merge_overlapping_boxes(segs, args.iou_threshold)
         print(f"🔗 After merging overlapping segments: {len(segs)}")
 
+    segs += overall_segs
+
     # 6) write JSON
     with open(args.segments_json, "w") as f:
-        json.dump({"segments": segs}, f, indent=2)
+        json.dump({"segments": segs, "class_policy": policy_report}, f, indent=2)
     print(f"✅ Wrote {len(segs)} segments to {args.segments_json}")
 
     # 7) optionally draw & save